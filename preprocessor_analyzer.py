@@ -1,65 +1,194 @@
-from dataclasses import dataclass, field
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Dict, Set, List, Optional
+import logging
+import os
 import re
+import sys
 import json
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# Precompiled patterns -- compiling these once at import time avoids paying
+# re-cache lookups and case-insensitive compilation for every file scanned.
+USE_RE = re.compile(r'use\s+(\w+)(?:\s*,\s*only\s*:)?', re.IGNORECASE)
+KIND_PAIR_RE = re.compile(r'(\w+)\s*=>\s*(\w+)')
+PARAM_RE = re.compile(r'integer\s*,\s*parameter\s*::\s*(\w+)\s*=\s*(\w+)', re.IGNORECASE)
+DEFINED_RE = re.compile(r'defined\((\w+)\)')
+ALLOCATE_RE = re.compile(r'allocate\s*\((\w+)\s*\(([^)]+)\)\)', re.IGNORECASE)
+ARITH_TOKEN_RE = re.compile(r'\d+|\w+|[-+*/()]')
+# One fused alternation so _analyze_memory_usage extracts kind mappings,
+# declarations and parameter values in a single pass over the content
+MEMORY_RE = re.compile(
+    r'(?P<kindmap>use\s+iso_fortran_env\s*,\s*only\s*:(?P<mappings>[^\n!]*))'
+    r'|(?P<static>real\s*\((?P<static_kind>\w+)\)\s*,\s*dimension\s*'
+    r'\((?P<static_dims>[^)]+)\)\s*::\s*(?P<static_name>\w+))'
+    r'|(?P<alloc>real\s*\((?P<alloc_kind>\w+)\)\s*,\s*allocatable\s*::\s*'
+    r'(?P<alloc_name>\w+)(?:\([,:]*\))?)'
+    r'|(?P<derived>type\s*\((?P<derived_type>\w+)\).*?::\s*(?P<derived_name>\w+))'
+    r'|(?P<param>integer\s*,\s*parameter\s*::\s*(?P<param_name>\w+)\s*=\s*'
+    r'(?P<param_value>\d+))',
+    re.IGNORECASE)
+COMBINED_RE = re.compile(
+    r'(?:^|\n)\s*(?:(?P<mod>module)|(?P<prog>program)|(?P<use>use))\s+(?P<name>\w+)',
+    re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def _compile_expr(expr: str):
+    """Compile an expression to a code object, cached per expression string.
+
+    After defines substitution most expressions are tiny constant
+    booleans, which compile() constant-folds, so re-evaluating a cached
+    code object is essentially free.
+    """
+    return compile(expr, '<preprocessor>', 'eval')
+
+
+@lru_cache(maxsize=None)
+def _build_defines_pattern(defines_key: tuple) -> Optional[re.Pattern]:
+    """Compile one alternation matching any define name, per defines set."""
+    if not defines_key:
+        return None
+    return re.compile(r'\b(' + '|'.join(map(re.escape, defines_key)) + r')\b')
+
+
+@lru_cache(maxsize=1024)
+def _evaluate_expression_cached(expr: str, defines_items: tuple) -> bool:
+    """Evaluate a preprocessor expression against a frozen defines set.
+
+    Typical codebases repeat the same handful of #if expressions, so the
+    substitution and eval run once per distinct (expr, defines) pair and
+    every later hit is a dict lookup.
+    """
+    defines = dict(defines_items)
+
+    # Replace defined() calls
+    expr = DEFINED_RE.sub(lambda m: str(m.group(1) in defines), expr)
+
+    # Replace && with and, || with or
+    expr = expr.replace('&&', ' and ').replace('||', ' or ')
+
+    # Replace define names with their values in a single pass
+    defines_pattern = _build_defines_pattern(tuple(defines))
+    if defines_pattern is not None:
+        expr = defines_pattern.sub(lambda m: str(defines[m.group(1)]), expr)
+
+    try:
+        logger.debug("Evaluating expression: %s", expr)
+        return bool(eval(_compile_expr(expr), {"__builtins__": {}}, {}))
+    except Exception as e:
+        logger.warning("Could not evaluate preprocessor expression: %s (%s)",
+                       expr, e)
+        return False
+
 @dataclass
 class PreprocessorState:
+    """Conditional-block state kept as integers instead of a list stack.
+
+    is_active() runs once per source line, so it must be O(1): a count of
+    currently-false blocks replaces all() over a list, and a bitmask holds
+    the pushed values so #else can invert the innermost block.
+    """
     defines: Dict[str, bool]
-    active_blocks: List[bool] = field(default_factory=lambda: [True])
-    
+    depth: int = 0
+    inactive_depth: int = 0
+    stack_mask: int = 0
+
     def is_active(self) -> bool:
-        return all(self.active_blocks)
+        return self.inactive_depth == 0
+
+    def push(self, value: bool) -> None:
+        self.depth += 1
+        self.stack_mask = (self.stack_mask << 1) | (1 if value else 0)
+        if not value:
+            self.inactive_depth += 1
+
+    def pop(self) -> None:
+        if not self.depth:
+            return
+        if not self.stack_mask & 1:
+            self.inactive_depth -= 1
+        self.stack_mask >>= 1
+        self.depth -= 1
+
+    def flip(self) -> None:
+        """Invert the innermost block (#else)."""
+        if not self.depth:
+            return
+        self.stack_mask ^= 1
+        self.inactive_depth += -1 if self.stack_mask & 1 else 1
 
 class ModuleDependencyAnalyzer:
     def __init__(self, source_dir: Path):
         self.source_dir = Path(source_dir)
         self.modules: Dict[str, Path] = {}
         self.programs: Dict[str, Path] = {}
-        self.dependencies: Dict[str, Set[str]] = {}
-        
+        self.dependencies: Dict[str, Set[str]] = defaultdict(set)
+        self._file_cache: Dict[Path, str] = {}
+        self._scanned = False
+        self._analyze_cache: Dict[str, List[str]] = {}
+
     def scan_files(self):
-        """Scan directory for all module definitions and programs."""
-        for f90_file in self.source_dir.glob("*.F90"):
-            with open(f90_file) as f:
-                content = f.read()
-                # Find module definitions
-                for match in re.finditer(r'(?i)module\s+(\w+)', content):
-                    module_name = match.group(1).lower()
-                    self.modules[module_name] = f90_file
-                
-                # Find program definitions
-                for match in re.finditer(r'(?i)program\s+(\w+)', content):
-                    program_name = match.group(1).lower()
-                    self.programs[program_name] = f90_file
-                    
-    def analyze_dependencies(self):
-        """Build dependency graph for all modules and programs."""
-        # Analyze module dependencies
-        for module_name, file_path in self.modules.items():
-            self._analyze_file_dependencies(module_name, file_path)
-            
-        # Analyze program dependencies
-        for program_name, file_path in self.programs.items():
-            self._analyze_file_dependencies(program_name, file_path)
-    
-    def _analyze_file_dependencies(self, name: str, file_path: Path):
-        """Analyze dependencies for a single file."""
-        with open(file_path) as f:
-            content = f.read()
-            deps = set()
-            # Find USE statements
-            for match in re.finditer(r'(?i)use\s+(\w+)', content):
-                used_module = match.group(1).lower()
-                deps.add(used_module)
-            self.dependencies[name] = deps
-                
+        """Scan directory once for definitions and USE dependencies.
+
+        A single combined-regex pass per file picks up module definitions,
+        program definitions and USE statements together, attributing each
+        USE to the most recently seen module/program.  File contents are
+        cached so later stages never re-read from disk.  Idempotent:
+        repeat calls on the same analyzer are no-ops.
+        """
+        if self._scanned:
+            return
+        self._scanned = True
+        with os.scandir(self.source_dir) as it:
+            entries = [e.path for e in it
+                       if e.name.endswith('.F90')
+                       and e.is_file(follow_symlinks=False)]
+        # Hoist attribute lookups out of the per-match loop
+        modules = self.modules
+        programs = self.programs
+        deps_map = self.dependencies
+        intern = sys.intern
+        for entry_path in entries:
+            f90_file = Path(entry_path)
+            content = f90_file.read_bytes().decode('utf-8', errors='replace')
+            self._file_cache[f90_file] = content
+            current_deps = None
+            for match in COMBINED_RE.finditer(content):
+                # Interned names make the graph's dict/set operations
+                # pointer comparisons instead of full string hashes
+                name = intern(match.group('name').lower())
+                if match.group('use'):
+                    if current_deps is not None:
+                        current_deps.add(name)
+                elif match.group('mod'):
+                    modules[name] = f90_file
+                    current_deps = deps_map[name]
+                else:
+                    programs[name] = f90_file
+                    current_deps = deps_map[name]
+
+    def file_content(self, path: Path) -> str:
+        """Return a file's contents, reading from disk only on a miss."""
+        content = self._file_cache.get(path)
+        if content is None:
+            content = path.read_bytes().decode('utf-8', errors='replace')
+            self._file_cache[path] = content
+        return content
+
     def analyze_file(self, filename: str) -> List[str]:
-        """Analyze a specific file and return required modules in order."""
+        """Analyze a specific file and return required modules in order.
+
+        Results are memoized per filename so repeat calls (one per .F90
+        file in a directory, in the worst case) cost a dict lookup.
+        """
+        if filename in self._analyze_cache:
+            return self._analyze_cache[filename]
         self.scan_files()
-        self.analyze_dependencies()
-        
+
         # Find which module or program this file defines
         target_name = None
         for module, path in self.modules.items():
@@ -74,125 +203,171 @@ class ModuleDependencyAnalyzer:
                     break
                     
         if target_name is None:
+            self._analyze_cache[filename] = []
             return []
-            
-        # Get ordered list of dependencies
-        needed = []
-        visited = set()
-        
-        def visit(name: str):
-            if name in visited:
-                return
-            visited.add(name)
-            for dep in self.dependencies.get(name, set()):
-                visit(dep)
-                if dep not in needed:
-                    needed.append(dep)
-            
-        visit(target_name)
-        needed.append(target_name)
-        return needed
+
+
+        # Restrict to the subgraph reachable from the target
+        reachable = set()
+        stack = [target_name]
+        while stack:
+            node = stack.pop()
+            if node in reachable:
+                continue
+            reachable.add(node)
+            stack.extend(self.dependencies.get(node, ()))
+
+        # Kahn's algorithm over the reverse adjacency map: a unit is
+        # emitted once all of its dependencies have been emitted, so the
+        # traversal is O(V+E) with no linear membership checks.
+        reverse = defaultdict(list)
+        in_degree = Counter()
+        for unit in sorted(reachable):
+            for dep in self.dependencies.get(unit, ()):
+                reverse[dep].append(unit)
+                in_degree[unit] += 1
+
+        order = []
+        queue = deque(n for n in sorted(reachable) if in_degree[n] == 0)
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for dependent in reverse[node]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+        self._analyze_cache[filename] = order
+        return order
 
 class PreprocessorParser:
-    def __init__(self, config_file: str):
-        with open(config_file, 'r') as f:
-            config = json.load(f)
-        print(f"Loaded config: {config}")  # Debug
-        
+    def __init__(self, config_file: Optional[str] = None,
+                 config: Optional[dict] = None):
+        if config is None:
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+        logger.debug("Loaded config: %s", config)
+
         config_section = config['preprocessor_config']
         self.state = PreprocessorState(defines=config_section.get('defines', {}))
         self.grid_params = config_section.get('grid_parameters', {})
-    
-    def parse_file(self, filepath: Path) -> str:
-        """Parse file content considering preprocessor directives."""
-        content = filepath.read_text()
-        processed_lines = []
-        
-        print(f"\nProcessing file: {filepath}")  # Debug
-        
-        lines = content.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            
-            if line.startswith('#'):
-                print(f"Processing directive: {line}")  # Debug
-                print(f"Current active blocks before: {self.state.active_blocks}")  # Debug
-                i = self._handle_preprocessor_directive(lines, i, processed_lines)
-                print(f"Current active blocks after: {self.state.active_blocks}")  # Debug
+        # Defines are fixed for the parser's lifetime; freezing the key
+        # here primes the substitution-regex/eval caches once instead of
+        # re-sorting the defines on every expression evaluation
+        self._defines_items = tuple(sorted(self.state.defines.items()))
+        _build_defines_pattern(tuple(sorted(self.state.defines)))
+        self._directive_handlers = {
+            '#if': self._do_if,
+            '#endif': self._do_endif,
+            '#ifdef': self._do_ifdef,
+            '#ifndef': self._do_ifndef,
+            '#elif': self._do_elif,
+            '#else': self._do_else,
+        }
+        # Fallback for no-space forms like '#if(EXPR)'; longer prefixes
+        # first so '#ifdef'/'#ifndef' are not mistaken for '#if'
+        self._directive_prefixes = [
+            ('#ifdef', self._do_ifdef),
+            ('#ifndef', self._do_ifndef),
+            ('#endif', self._do_endif),
+            ('#elif', self._do_elif),
+            ('#else', self._do_else),
+            ('#if', self._do_if),
+        ]
+
+    @classmethod
+    def from_dict(cls, config: dict) -> 'PreprocessorParser':
+        """Build a parser from an already-loaded config dict."""
+        return cls(config=config)
+
+    def parse_file(self, filepath: Path, content: Optional[str] = None) -> str:
+        """Parse file content considering preprocessor directives.
+
+        Callers that already hold the file's contents (the dependency
+        scanner caches them) pass it in to avoid a second read. Walks the
+        file once tracking (start, end) offsets of the retained regions
+        instead of materializing a list of line copies, so the only
+        allocation beyond the source text is the span list and the final
+        joined result.
+        """
+        if content is None:
+            content = filepath.read_bytes().decode('utf-8', errors='replace')
+        logger.debug("Processing file: %s", filepath)
+
+        kept_spans = []  # (start, end) offsets into content
+        pos = 0
+        for line in content.splitlines(keepends=True):
+            end = pos + len(line)
+            stripped = line.strip()
+            if stripped.startswith('#'):
+                logger.debug("Processing directive: %s", stripped)
+                self._handle_preprocessor_directive(stripped)
             elif self.state.is_active():
-                processed_lines.append(lines[i])  # Keep original line with whitespace
-                if 'dimension' in line or 'allocatable' in line:  # Debug
-                    print(f"Including line: {lines[i]}")  # Debug
-            i += 1
-            
-        processed_content = '\n'.join(processed_lines)
-        print("\nProcessed content:")  # Debug
-        print(processed_content)  # Debug
+                # Contiguous kept lines extend the previous span so the
+                # final join copies large blocks, not individual lines
+                if kept_spans and kept_spans[-1][1] == pos:
+                    kept_spans[-1] = (kept_spans[-1][0], end)
+                else:
+                    kept_spans.append((pos, end))
+            pos = end
+
+        processed_content = ''.join(content[s:e] for s, e in kept_spans)
+        logger.debug("Processed content:\n%s", processed_content)
         return processed_content
-    
-    def _handle_preprocessor_directive(self, lines: List[str], i: int, 
-                                     processed_lines: List[str]) -> int:
-        """Handle preprocessor directives and return next line index."""
-        line = lines[i].strip()
-        
-        if line.startswith('#ifdef'):
-            define = line.split()[-1]
-            is_defined = self.state.defines.get(define, False)
-            print(f"ifdef {define}: {is_defined}")  # Debug
-            self.state.active_blocks.append(is_defined)
-            
-        elif line.startswith('#ifndef'):
-            define = line.split()[-1]
-            is_defined = not self.state.defines.get(define, False)
-            print(f"ifndef {define}: {is_defined}")  # Debug
-            self.state.active_blocks.append(is_defined)
-            
-        elif line.startswith('#if'):
-            expr = line[3:].strip()
-            result = self._evaluate_preprocessor_expression(expr)
-            print(f"if {expr}: {result}")  # Debug
-            self.state.active_blocks.append(result)
-            
-        elif line.startswith('#elif'):
-            if self.state.active_blocks:
-                self.state.active_blocks.pop()
-                expr = line[5:].strip()
-                result = self._evaluate_preprocessor_expression(expr)
-                print(f"elif {expr}: {result}")  # Debug
-                self.state.active_blocks.append(result)
-            
-        elif line.startswith('#else'):
-            if self.state.active_blocks:
-                current = self.state.active_blocks.pop()
-                self.state.active_blocks.append(not current)
-            
-        elif line.startswith('#endif'):
-            if self.state.active_blocks:
-                self.state.active_blocks.pop()
-        
-        return i + 1
-    
+
+    def _handle_preprocessor_directive(self, line: str) -> None:
+        """Dispatch a single (stripped) preprocessor directive line.
+
+        One dict lookup on the first whitespace-separated token replaces
+        the old chain of startswith checks for the common case; directives
+        written without a space ('#if(EXPR)') fall back to prefix matching
+        so they are still honoured.
+        """
+        parts = line.split(None, 1)
+        cmd = parts[0]
+        rest = parts[1] if len(parts) > 1 else ''
+        handler = self._directive_handlers.get(cmd)
+        if handler is None:
+            for prefix, prefix_handler in self._directive_prefixes:
+                if cmd.startswith(prefix):
+                    handler = prefix_handler
+                    rest = line[len(prefix):]
+                    break
+        if handler is not None:
+            handler(rest.strip())
+
+    def _do_ifdef(self, rest: str) -> None:
+        define = rest.split()[-1] if rest else rest
+        is_defined = self.state.defines.get(define, False)
+        logger.debug("ifdef %s: %s", define, is_defined)
+        self.state.push(is_defined)
+
+    def _do_ifndef(self, rest: str) -> None:
+        define = rest.split()[-1] if rest else rest
+        is_defined = not self.state.defines.get(define, False)
+        logger.debug("ifndef %s: %s", define, is_defined)
+        self.state.push(is_defined)
+
+    def _do_if(self, rest: str) -> None:
+        result = self._evaluate_preprocessor_expression(rest)
+        logger.debug("if %s: %s", rest, result)
+        self.state.push(result)
+
+    def _do_elif(self, rest: str) -> None:
+        if self.state.depth:
+            self.state.pop()
+            result = self._evaluate_preprocessor_expression(rest)
+            logger.debug("elif %s: %s", rest, result)
+            self.state.push(result)
+
+    def _do_else(self, rest: str) -> None:
+        self.state.flip()
+
+    def _do_endif(self, rest: str) -> None:
+        self.state.pop()
+
     def _evaluate_preprocessor_expression(self, expr: str) -> bool:
-        """Evaluate preprocessor expressions."""
-        # Replace defined() calls
-        expr = re.sub(r'defined\((\w+)\)', 
-                     lambda m: str(m.group(1) in self.state.defines), expr)
-        
-        # Replace && with and, || with or
-        expr = expr.replace('&&', ' and ').replace('||', ' or ')
-        
-        # Replace define names with their values
-        for define, value in self.state.defines.items():
-            expr = re.sub(r'\b{}\b'.format(define), str(value), expr)
-        
-        try:
-            print(f"Evaluating expression: {expr}")  # Debug
-            return bool(eval(expr, {"__builtins__": {}}, {}))
-        except Exception as e:
-            print(f"Warning: Could not evaluate preprocessor expression: {expr}")
-            print(f"Error: {str(e)}")
-            return False
+        """Evaluate preprocessor expressions, memoized per defines set."""
+        return _evaluate_expression_cached(expr, self._defines_items)
 
     def get_value(self, param_name: str) -> Optional[int]:
         """Get value from either grid_parameters or defines."""
@@ -203,23 +378,39 @@ class PreprocessorParser:
         return None
 
 class EnhancedModuleAnalyzer:
-    def __init__(self, source_root: str, config_file: str):
+    def __init__(self, source_root: str, config_file: Optional[str] = None,
+                 config_dict: Optional[dict] = None):
         self.source_root = Path(source_root)
-        print(f"Initializing analyzer with root: {source_root}")  # Debug
-        self.preprocessor = PreprocessorParser(config_file)
-        self.processed_contents = {} 
-    
+        logger.debug("Initializing analyzer with root: %s", source_root)
+        if config_dict is not None:
+            self.preprocessor = PreprocessorParser.from_dict(config_dict)
+        else:
+            self.preprocessor = PreprocessorParser(config_file)
+        self._dep_analyzer = None
+        self._params_cache: Dict[str, int] = {}
+
+    @property
+    def dep_analyzer(self) -> ModuleDependencyAnalyzer:
+        """Dependency analyzer for the source root, created on first use."""
+        if self._dep_analyzer is None:
+            self._dep_analyzer = ModuleDependencyAnalyzer(self.source_root)
+        return self._dep_analyzer
+
     def analyze_module(self, filename: str) -> dict:
         """Analyze a file (module or program) with preprocessor handling."""
-        # First analyze dependencies
-        dep_analyzer = ModuleDependencyAnalyzer(self.source_root)
+        # First analyze dependencies (the analyzer is reused across calls
+        # so the source directory is only scanned once)
+        dep_analyzer = self.dep_analyzer
         unit_order = dep_analyzer.analyze_file(filename)
+
+        logger.debug("Dependency order for %s: %s", filename, unit_order)
         
-        print(f"\nDependency order for {filename}: {unit_order}")  # Debug
-        
-        # Save all processed contents for parameter lookup
-        self.processed_contents = {}
-        
+        # Parameters are the only state needed from processed units, so
+        # extract them as each unit is parsed and let the processed text
+        # itself be garbage collected instead of pinning every file's
+        # contents for the whole run
+        self._params_cache = dict(self.preprocessor.state.defines)
+
         results = {}
         # Process units in dependency order
         for unit in unit_order:
@@ -228,13 +419,14 @@ class EnhancedModuleAnalyzer:
                         dep_analyzer.programs.get(unit))
             
             if not unit_file:
-                print(f"Could not find file for {unit}")
+                logger.warning("Could not find file for %s", unit)
                 continue
-                
-            print(f"Processing unit: {unit}")
-            processed_content = self.preprocessor.parse_file(unit_file)
-            self.processed_contents[unit] = processed_content
-            
+
+            logger.debug("Processing unit: %s", unit)
+            processed_content = self.preprocessor.parse_file(
+                unit_file, dep_analyzer.file_content(unit_file))
+            self._params_cache.update(self._collect_parameters(processed_content))
+
             # Analyze memory usage
             memory_usage = self._analyze_memory_usage(processed_content)
             unit_result = {
@@ -253,67 +445,68 @@ class EnhancedModuleAnalyzer:
         return results
     
     def _analyze_memory_usage(self, content: str) -> dict:
-        """Analyze memory usage in preprocessed content."""
+        """Analyze memory usage in preprocessed content.
+
+        A single fused-alternation pass extracts kind mappings, array
+        declarations and parameter values together, and allocate
+        statements are gathered up front into a dict keyed by variable
+        name instead of one re.search over the content per allocatable.
+        """
         memory_info = {
             'static_arrays': [],
             'allocatable_arrays': [],
             'derived_types': []
         }
-        
-        # Track kind mappings
+
+        # Map each allocated variable to its dimensions (first allocate wins)
+        allocate_map = {}
+        for alloc in ALLOCATE_RE.finditer(content):
+            allocate_map.setdefault(alloc.group(1), alloc.group(2))
+
         kind_mappings = {}
-        for match in re.finditer(r'(?i)use\s+iso_fortran_env\s*,\s*only\s*:([^!]*)', content):
-            mappings = match.group(1)
-            for mapping in re.finditer(r'(\w+)\s*=>\s*(\w+)', mappings):
-                kind_mappings[mapping.group(1)] = mapping.group(2)
-        
-        # Analysis patterns - updated to handle more type formats
-        patterns = {
-            'static_arrays': r'(?i)real\s*\((\w+)\)\s*,\s*dimension\s*\(([^)]+)\)\s*::\s*(\w+)',
-            'allocatable_arrays': r'(?i)real\s*\((\w+)\)\s*,\s*allocatable\s*::\s*(\w+)(?:\([,:]*\))?',
-            'derived_types': r'(?i)type\s*\((\w+)\).*?::\s*(\w+)'
-        }
-        
-        # Find parameter values (like n)
         param_values = {}
-        for match in re.finditer(r'(?i)integer\s*,\s*parameter\s*::\s*(\w+)\s*=\s*(\d+)', content):
-            param_values[match.group(1)] = int(match.group(2))
-        
-        print("\nAnalyzing patterns:")  # Debug
-        for category, pattern in patterns.items():
-            print(f"\nLooking for {category}")  # Debug
-            print(f"Pattern: {pattern}")  # Debug
-            for match in re.finditer(pattern, content):
-                print(f"Found match: {match.groups()}")  # Debug
-                if category == 'allocatable_arrays':
-                    kind_param, name = match.groups()
-                    # Look for matching allocate statement
-                    alloc_pattern = rf'(?i)allocate\s*\({name}\s*\(([^)]+)\)\)'
-                    alloc_match = re.search(alloc_pattern, content)
-                    if alloc_match:
-                        dims = alloc_match.group(1)
-                        # Translate kind (RK -> real64)
-                        actual_kind = kind_mappings.get(kind_param, kind_param)
-                        size = self._calculate_array_size(dims, actual_kind)
-                        memory_info[category].append({
-                            'name': name,
-                            'type': f"real({actual_kind})",
-                            'dimensions': dims,
-                            'estimated_size': size
-                        })
-                elif category == 'static_arrays':
-                    type_param, dims, name = match.groups()
-                    size = self._calculate_array_size(dims, type_param)
-                    memory_info[category].append({
+
+        for match in MEMORY_RE.finditer(content):
+            if match.group('kindmap') is not None:
+                # Track kind mappings (use statements precede declarations,
+                # so these are seen before any allocatable that needs them)
+                for mapping in KIND_PAIR_RE.finditer(match.group('mappings')):
+                    kind_mappings[mapping.group(1)] = mapping.group(2)
+            elif match.group('static') is not None:
+                type_param = match.group('static_kind')
+                dims = match.group('static_dims')
+                name = match.group('static_name')
+                logger.debug("Found static array: %s", name)
+                size = self._calculate_array_size(dims, type_param)
+                memory_info['static_arrays'].append({
+                    'name': name,
+                    'type': type_param,
+                    'dimensions': dims,
+                    'estimated_size': size
+                })
+            elif match.group('alloc') is not None:
+                kind_param = match.group('alloc_kind')
+                name = match.group('alloc_name')
+                logger.debug("Found allocatable array: %s", name)
+                dims = allocate_map.get(name)
+                if dims is not None:
+                    # Translate kind (RK -> real64)
+                    actual_kind = kind_mappings.get(kind_param, kind_param)
+                    size = self._calculate_array_size(dims, actual_kind)
+                    memory_info['allocatable_arrays'].append({
                         'name': name,
-                        'type': type_param,
+                        'type': f"real({actual_kind})",
                         'dimensions': dims,
                         'estimated_size': size
                     })
-                else:
-                    name = match.group(1)
-                    memory_info[category].append({'name': name})
-        
+            elif match.group('derived') is not None:
+                logger.debug("Found derived type: %s", match.group('derived_name'))
+                memory_info['derived_types'].append(
+                    {'name': match.group('derived_type')})
+            else:
+                param_values[match.group('param_name')] = \
+                    int(match.group('param_value'))
+
         return memory_info
 
     def _collect_parameters(self, content: str) -> Dict[str, int]:
@@ -323,7 +516,7 @@ class EnhancedModuleAnalyzer:
         params.update(self.preprocessor.state.defines)
         
         # Then look for Fortran parameters
-        for match in re.finditer(r'(?i)integer\s*,\s*parameter\s*::\s*(\w+)\s*=\s*(\w+)', content):
+        for match in PARAM_RE.finditer(content):
             param_name = match.group(1)
             param_value = match.group(2)
             # If the value is another parameter, look it up
@@ -333,41 +526,87 @@ class EnhancedModuleAnalyzer:
                 try:
                     params[param_name] = int(param_value)
                 except ValueError:
-                    print(f"Could not convert {param_value} to integer")
+                    logger.warning("Could not convert %s to integer", param_value)
         return params
 
+    def _eval_arith(self, expr: str, params: Dict[str, int]) -> int:
+        """Evaluate a small integer arithmetic expression like 'n-1' or '2*(n+1)'.
+
+        A recursive-descent parser over INT/IDENT/+-*/() tokens resolving
+        identifiers against params directly; unlike textual substitution
+        this cannot corrupt longer names sharing a prefix ('n' vs 'nmax'),
+        and it avoids eval() entirely.  Raises on unknown identifiers or
+        malformed input.
+        """
+        tokens = ARITH_TOKEN_RE.findall(expr)
+        if not tokens:
+            raise ValueError(f"empty expression: {expr!r}")
+        pos = 0
+
+        def atom() -> int:
+            nonlocal pos
+            if pos >= len(tokens):
+                raise ValueError(f"truncated expression: {expr!r}")
+            tok = tokens[pos]
+            pos += 1
+            if tok == '(':
+                val = addsub()
+                if pos >= len(tokens) or tokens[pos] != ')':
+                    raise ValueError(f"unbalanced parentheses: {expr!r}")
+                pos += 1
+                return val
+            if tok == '-':
+                return -atom()
+            if tok == '+':
+                return atom()
+            if tok.isdigit():
+                return int(tok)
+            if tok in params:
+                return int(params[tok])
+            raise KeyError(tok)
+
+        def muldiv() -> int:
+            nonlocal pos
+            val = atom()
+            while pos < len(tokens) and tokens[pos] in '*/':
+                op = tokens[pos]
+                pos += 1
+                rhs = atom()
+                val = val * rhs if op == '*' else val // rhs
+            return val
+
+        def addsub() -> int:
+            nonlocal pos
+            val = muldiv()
+            while pos < len(tokens) and tokens[pos] in '+-':
+                op = tokens[pos]
+                pos += 1
+                rhs = muldiv()
+                val = val + rhs if op == '+' else val - rhs
+            return val
+
+        result = addsub()
+        if pos != len(tokens):
+            raise ValueError(f"trailing tokens in expression: {expr!r}")
+        return result
+
     def _evaluate_range(self, range_expr: str, params: Dict[str, int]) -> int:
         """Evaluate a Fortran array range expression like '1:n' or '0:n-1'."""
         if ':' not in range_expr:
             return 1  # Single index
-            
+
         start, end = [x.strip() for x in range_expr.split(':')]
-        print(f"Evaluating range {start}:{end} with params {params}")
-        
-        # Replace parameters with their values
-        for param, value in params.items():
-            start = start.replace(param, str(value))
-            end = end.replace(param, str(value))
-        
-        print(f"After substitution: {start}:{end}")
-        
-        # Create a safe dict for eval
-        safe_dict = {
-            "__builtins__": None,
-            "abs": abs,
-            "min": min,
-            "max": max
-        }
-        
+        logger.debug("Evaluating range %s:%s with params %s", start, end, params)
+
         try:
-            start_val = int(eval(start, {"__builtins__": None}, safe_dict))
-            end_val = int(eval(end, {"__builtins__": None}, safe_dict))
+            start_val = self._eval_arith(start, params)
+            end_val = self._eval_arith(end, params)
             size = end_val - start_val + 1
-            print(f"Calculated size: {size}")
+            logger.debug("Calculated size: %s", size)
             return size
         except Exception as e:
-            print(f"Could not evaluate range {start}:{end}: {str(e)}")
-            print("Using default size")
+            logger.warning("Could not evaluate range %s:%s (%s); using default size",
+                           start, end, e)
             return 100  # Default size if we can't evaluate
 
     def _calculate_array_size(self, dims_str: str, type_str: str) -> int:
@@ -381,33 +620,34 @@ class EnhancedModuleAnalyzer:
             'int32': 4
         }
         
-        print(f"\nCalculating size for type {type_str} with dimensions {dims_str}")
+        logger.debug("Calculating size for type %s with dimensions %s",
+                     type_str, dims_str)
         total_elements = 1
-        
-        # Collect all parameters from all processed contents
-        params = {}
-        for content in self.processed_contents.values():
-            params.update(self._collect_parameters(content))
+
+        # Parameters from all units processed so far, maintained by
+        # analyze_module as each unit is parsed
+        params = self._params_cache
 
         # Process each dimension
         dims = [d.strip() for d in dims_str.split(',')]
         for dim in dims:
-            print(f"Processing dimension: {dim}")
             size = self._evaluate_range(dim, params)
-            print(f"Dimension size: {size}")
+            logger.debug("Dimension %s has size %s", dim, size)
             total_elements *= size
-        
+
         type_size = type_sizes.get(type_str, 8)
         total_size = total_elements * type_size
-        print(f"Final calculation: {total_elements} elements * {type_size} bytes = {total_size} bytes")
+        logger.debug("Final calculation: %s elements * %s bytes = %s bytes",
+                     total_elements, type_size, total_size)
         return total_size
 
     def _find_dependencies(self, content: str) -> List[str]:
         """Find module dependencies."""
         deps = []
-        for match in re.finditer(r'(?i)use\s+(\w+)(?:\s*,\s*only\s*:)?', content):
+        for match in USE_RE.finditer(content):
             module_name = match.group(1)
-            if module_name.lower() not in deps:  # avoid duplicates
-                deps.append(module_name.lower())
+            module_name = sys.intern(module_name.lower())
+            if module_name not in deps:  # avoid duplicates
+                deps.append(module_name)
         return deps
 
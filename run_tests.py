@@ -2,9 +2,24 @@
 
 import argparse
 import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from preprocessor_analyzer import EnhancedModuleAnalyzer
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj) -> bytes:
+    """Encode obj as indented JSON bytes, via orjson's C encoder if available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode("utf-8")
+
 class TestRunner:
     def __init__(self, tests_root: Path):
         self.tests_root = Path(tests_root)
@@ -13,9 +28,13 @@ class TestRunner:
     def discover_tests(self):
         """Find all test directories that contain preprocessor_config.json."""
         test_dirs = []
-        for d in self.tests_root.glob("test*"):
-            if d.is_dir() and (d / "preprocessor_config.json").exists():
-                test_dirs.append(d)
+        with os.scandir(self.tests_root) as it:
+            for entry in it:
+                if (entry.name.startswith("test")
+                        and entry.is_dir(follow_symlinks=False)
+                        and os.path.exists(os.path.join(entry.path,
+                                                        "preprocessor_config.json"))):
+                    test_dirs.append(Path(entry.path))
         return sorted(test_dirs)
 
     def run_single_test(self, test_dir: Path):
@@ -23,27 +42,32 @@ class TestRunner:
         print(f"\nRunning test in {test_dir.name}")
         print("=" * 50)
         
+        # Load the config once and hand the dict to the analyzer so the
+        # parser does not re-read and re-parse the same file
         config_file = test_dir / "preprocessor_config.json"
         with open(config_file) as f:
             config = json.load(f)
-            if "test_description" in config["preprocessor_config"]:
-                print(f"Test description: {config['preprocessor_config']['test_description']}")
-        
+        if "test_description" in config["preprocessor_config"]:
+            print(f"Test description: {config['preprocessor_config']['test_description']}")
+
         # Initialize analyzer for this test
-        analyzer = EnhancedModuleAnalyzer(str(test_dir), str(config_file))
-        
-        # Find main program file
-        main_program = None
-        for f90_file in test_dir.glob("*.F90"):
-            with open(f90_file) as f:
-                if 'program' in f.read().lower():
-                    main_program = f90_file
-                    break
+        analyzer = EnhancedModuleAnalyzer(str(test_dir), config_dict=config)
         
+        # Find the main program from the dependency scan instead of
+        # re-reading every file just to probe for a 'program' statement
+        dep_analyzer = analyzer.dep_analyzer
+        dep_analyzer.scan_files()
+        main_program = min(dep_analyzer.programs.values(),
+                           key=lambda p: p.name, default=None)
+
         if not main_program:
             print("No main program found, analyzing all files separately")
             test_results = {}
-            for f90_file in test_dir.glob("*.F90"):
+            with os.scandir(test_dir) as it:
+                f90_files = sorted(Path(e.path) for e in it
+                                   if e.name.endswith(".F90")
+                                   and e.is_file(follow_symlinks=False))
+            for f90_file in f90_files:
                 print(f"Analyzing {f90_file.name}")
                 result = analyzer.analyze_module(f90_file.name)
                 test_results.update(result)  # Merge results at top level
@@ -53,38 +77,65 @@ class TestRunner:
             
         # Save results for this test
         output_file = test_dir / "memory_analysis.json"
-        with open(output_file, 'w') as f:
-            json.dump(test_results, f, indent=2)
-            
+        with open(output_file, 'wb') as f:
+            f.write(_json_dumps(test_results))
+
+
         print(f"\nResults saved to {output_file}")
         return test_results
 
     def run_all_tests(self):
-        """Discover and run all tests."""
+        """Discover and run all tests, one worker process per test directory.
+
+        Tests are fully independent -- each analyzes its own directory and
+        writes its own memory_analysis.json -- so they fan out across CPU
+        cores; only the summary is written from this process, streamed as
+        each test completes.
+        """
         test_dirs = self.discover_tests()
         print(f"Found {len(test_dirs)} test directories")
-        
-        for test_dir in test_dirs:
-            try:
-                self.results[test_dir.name] = self.run_single_test(test_dir)
-            except Exception as e:
-                print(f"Error in {test_dir.name}: {str(e)}")
-                self.results[test_dir.name] = {"error": str(e)}
-        
-        # Save summary of all results
+
         summary_file = self.tests_root / "test_summary.json"
-        with open(summary_file, 'w') as f:
-            json.dump(self.results, f, indent=2)
-        
+        with ProcessPoolExecutor() as executor, open(summary_file, 'wb') as f:
+            futures = {executor.submit(_run_one, test_dir): test_dir
+                       for test_dir in test_dirs}
+            f.write(b'{')
+            first = True
+            for future in as_completed(futures):
+                test_dir = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error in {test_dir.name}: {str(e)}")
+                    result = {"error": str(e)}
+                self.results[test_dir.name] = result
+                if not first:
+                    f.write(b',')
+                first = False
+                f.write(_json_dumps(test_dir.name) + b': ' + _json_dumps(result))
+            f.write(b'}')
+
         print(f"\nAll test results saved to {summary_file}")
 
+def _run_one(test_dir: Path):
+    """Run a single test directory; module-level so it pickles to workers."""
+    return TestRunner(test_dir.parent).run_single_test(test_dir)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run memory analysis tests")
     parser.add_argument("--tests-dir", default="tests",
                        help="Root directory containing test subdirectories")
     parser.add_argument("--test", help="Run specific test (e.g., test1)")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                       help="Show analyzer debug output")
     args = parser.parse_args()
-    
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format="%(message)s")
+
+
     runner = TestRunner(args.tests_dir)
     
     if args.test: